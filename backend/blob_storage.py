@@ -1,11 +1,47 @@
 import os
-import json
-import io
+import orjson
+import functools
+import glob
 import lightgbm as lgb
+import msgpack
 import tempfile
 from abc import ABC, abstractmethod
-from prophet.serialize import model_from_json, model_to_json
-from prophet import Prophet
+
+def _decode_encoder(filename, payload: bytes):
+    """Encoder maps ship as JSON or msgpack; the manifest's file extension decides."""
+    if filename.endswith(".msgpack"):
+        return msgpack.unpackb(payload, raw=False)
+    return orjson.loads(payload)
+
+# --- Parsed-artifact caches (keyed on mtime so a replaced file is re-read) ---
+@functools.lru_cache(maxsize=32)
+def _read_json(path, mtime):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+@functools.lru_cache(maxsize=32)
+def _read_encoder(path, mtime):
+    with open(path, 'rb') as f:
+        return _decode_encoder(path, f.read())
+
+@functools.lru_cache(maxsize=4)
+def _read_booster(path, mtime):
+    return lgb.Booster(model_file=path)
+
+def _load_booster(path, manifest):
+    """Load the LGBM text dump and verify it against the manifest contract"""
+    model = _read_booster(path, os.path.getmtime(path))
+
+    # --- THE CONTRACT CHECK ---
+    expected_feats = manifest['global_model_config']['expected_features']
+    actual_feats = model.num_feature()
+
+    if actual_feats != expected_feats:
+        raise ValueError(
+            f"⛔ Model Contract Violation! Manifest expects {expected_feats} cols, "
+            f"but loaded model has {actual_feats}. Update manifest or retrain model."
+        )
+    return model
 
 # --- Abstract Interface ---
 class StorageBackend(ABC):
@@ -14,11 +50,11 @@ class StorageBackend(ABC):
     @abstractmethod
     def load_global_lgbm(self, manifest): pass
     @abstractmethod
-    def load_prophet_model(self, product_id: str): pass
-    @abstractmethod
     def load_encoder(self, manifest): pass
     @abstractmethod
-    def save_prophet_model(self, model, product_id: str): pass
+    def load_prophet_trend(self, product_id: str): pass
+    @abstractmethod
+    def save_prophet_trend(self, product_id: str, trend: dict): pass
 
 # --- Option A: Local Disk (Windows/Mac) ---
 class LocalStorage(StorageBackend):
@@ -37,8 +73,7 @@ class LocalStorage(StorageBackend):
             else:
                 raise FileNotFoundError(f"CRITICAL: Manifest missing at {self.manifest_path}")
         
-        with open(self.manifest_path, 'r') as f:
-            return json.load(f)
+        return _read_json(self.manifest_path, os.path.getmtime(self.manifest_path))
 
     def load_global_lgbm(self, manifest):
         """Step 2: Load Model & Verify Contract"""
@@ -52,49 +87,46 @@ class LocalStorage(StorageBackend):
             raise FileNotFoundError(f"LGBM model file {filename} missing!")
 
         print(f"✅ Loading LGBM from: {path}")
-        model = lgb.Booster(model_file=path)
-
-        # --- THE CONTRACT CHECK ---
-        expected_feats = manifest['global_model_config']['expected_features']
-        actual_feats = model.num_feature()
-        
-        if actual_feats != expected_feats:
-            raise ValueError(
-                f"⛔ Model Contract Violation! Manifest expects {expected_feats} cols, "
-                f"but loaded model has {actual_feats}. Update manifest or retrain model."
-            )
-        return model
+        return _load_booster(path, manifest)
 
     def load_encoder(self, manifest):
-        """Load JSON Encoder Map (Dict lookup, not Class)"""
+        """Load JSON/msgpack Encoder Map (Dict lookup, not Class)"""
         filename = manifest['global_model_config']['encoder_file']
         path = os.path.join(self.base_dir, "global_lgbm", filename)
         if not os.path.exists(path):
              path = os.path.join(self.base_dir, filename)
 
-        with open(path, 'r') as f:
-            return json.load(f)
+        return _read_encoder(path, os.path.getmtime(path))
+
+    def load_prophet_trend(self, product_id: str):
+        """Load cached Prophet output (ds/yhat) as msgpack"""
+        path = os.path.join(self.base_dir, "prophet_individual", f"{product_id}.trend.msgpack")
 
-    def load_prophet_model(self, product_id: str):
-        """Load Native JSON Prophet Model"""
-        # Look in the folder defined in your manifest
-        path = os.path.join(self.base_dir, "prophet_individual", f"{product_id}.json")
-        
         if not os.path.exists(path):
-            return None # Implies "New Model Needed"
-            
-        with open(path, 'r') as f:
-            return model_from_json(f.read())
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                return msgpack.unpackb(f.read(), raw=False)
+        except Exception:
+            return None # Unreadable trend is just a cache miss
 
-    def save_prophet_model(self, model, product_id: str):
-        """Save Native JSON Prophet Model"""
+    def save_prophet_trend(self, product_id: str, trend: dict):
+        """Save Prophet output (ds/yhat) as msgpack"""
         directory = os.path.join(self.base_dir, "prophet_individual")
         os.makedirs(directory, exist_ok=True)
-        
-        path = os.path.join(directory, f"{product_id}.json")
-        with open(path, 'w') as f:
-            f.write(model_to_json(model))
-        print(f"✅ Saved Prophet model for {product_id}")
+
+        path = os.path.join(directory, f"{product_id}.trend.msgpack")
+        # Unique temp name: background saves can run concurrently in one process
+        fd, partial_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(msgpack.packb(trend, use_bin_type=True))
+            os.replace(partial_path, path)  # atomic: readers never see a half-written file
+        except Exception:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
 
 # --- Option B: Azure Blob (Production) ---
 class AzureBlobStorage(StorageBackend):
@@ -111,53 +143,73 @@ class AzureBlobStorage(StorageBackend):
     def load_manifest(self):
         # Always assume it's in the global_lgbm folder in cloud
         blob = self.container.get_blob_client("global_lgbm/model_manifest.json")
-        stream = io.BytesIO()
-        blob.download_blob().readinto(stream)
-        stream.seek(0)
-        return json.load(stream)
+        return orjson.loads(blob.download_blob().readall())
 
     def load_global_lgbm(self, manifest):
         filename = manifest['active_global_model']
         blob_path = f"global_lgbm/{filename}"
         
         # LGBM needs a physical file path (C++ binding requirement)
-        temp_dir = tempfile.gettempdir()
-        local_path = os.path.join(temp_dir, filename)
-        
+        # Prefer tmpfs so the parser reads from RAM, not disk
+        temp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+        # Key the staged copy on the blob's etag: a retrained model uploaded under
+        # the same name gets a new etag, so a stale copy is never reused
+        from azure.core import MatchConditions
         blob = self.container.get_blob_client(blob_path)
-        with open(local_path, "wb") as f:
-            blob.download_blob().readinto(f)
-            
-        model = lgb.Booster(model_file=local_path)
-        
-        # Contract Check
-        if model.num_feature() != manifest['global_model_config']['expected_features']:
-             raise ValueError("Cloud Model Contract Violation!")
-             
-        return model
+        etag = blob.get_blob_properties().etag
+        version = etag.strip('"')
+        local_path = os.path.join(temp_dir, f"{version}_{filename}")
+
+        # Another worker may already have staged this exact blob version
+        if not os.path.exists(local_path):
+            partial_path = f"{local_path}.{os.getpid()}.part"
+            try:
+                with open(partial_path, "wb") as f:
+                    # Fails if the blob changes mid-download instead of mixing versions
+                    blob.download_blob(
+                        max_concurrency=8, etag=etag, match_condition=MatchConditions.IfNotModified
+                    ).readinto(f)
+                os.replace(partial_path, local_path)  # atomic: readers never see a half-written file
+            except Exception:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                raise
+
+            # tmpfs is RAM (64 MB by default in Docker): drop copies of superseded versions
+            for stale_path in glob.glob(os.path.join(temp_dir, f"*_{filename}")):
+                if stale_path != local_path:
+                    try:
+                        os.remove(stale_path)
+                    except OSError:
+                        pass # Another worker already removed it
+
+        return _load_booster(local_path, manifest)
 
     def load_encoder(self, manifest):
         filename = manifest['global_model_config']['encoder_file']
         blob = self.container.get_blob_client(f"global_lgbm/{filename}")
-        stream = io.BytesIO()
-        blob.download_blob().readinto(stream)
-        stream.seek(0)
-        return json.load(stream)
+        return _decode_encoder(filename, blob.download_blob().readall())
 
-    def load_prophet_model(self, product_id: str):
+    def load_prophet_trend(self, product_id: str):
         try:
-            blob = self.container.get_blob_client(f"prophet_individual/{product_id}.json")
-            stream = io.BytesIO()
-            blob.download_blob().readinto(stream)
-            stream.seek(0)
-            return model_from_json(stream.read().decode('utf-8'))
+            blob = self.container.get_blob_client(f"prophet_individual/{product_id}.trend.msgpack")
+            return msgpack.unpackb(blob.download_blob().readall(), raw=False)
         except Exception:
             return None
 
-    def save_prophet_model(self, model, product_id: str):
-        data = model_to_json(model)
-        blob = self.container.get_blob_client(f"prophet_individual/{product_id}.json")
-        blob.upload_blob(data, overwrite=True)
+    def save_prophet_trend(self, product_id: str, trend: dict):
+        from azure.storage.blob import ContentSettings
+        data = msgpack.packb(trend, use_bin_type=True)
+        blob = self.container.get_blob_client(f"prophet_individual/{product_id}.trend.msgpack")
+        # Known length + single connection = one Put Blob call (no block list commit)
+        blob.upload_blob(
+            data,
+            overwrite=True,
+            length=len(data),
+            max_concurrency=1,
+            content_settings=ContentSettings(content_type='application/x-msgpack'),
+        )
 
 # --- Factory ---
 def get_storage_backend():
@@ -0,0 +1,25 @@
+import pandas as pd
+import pyarrow.feather as feather
+
+# Run once after exporting new CSVs from the training pipeline:
+#   python convert_csv_to_parquet.py
+HISTORY_CSV = './ml_bin/sales_data_final.csv'
+HISTORY_PARQUET = './ml_bin/sales_data_final.parquet'
+FORECAST_CSV = './ml_bin/final_forecast_backup.csv'
+FORECAST_FEATHER = './ml_bin/final_forecast_backup.feather'
+
+def convert():
+    print(">>> 📦 Converting seed CSVs to columnar formats...")
+
+    # Wide history matrix -> Parquet (compressed, columnar)
+    df = pd.read_csv(HISTORY_CSV, engine='pyarrow')
+    df.to_parquet(HISTORY_PARQUET, index=False)
+    print(f"   ✅ {HISTORY_CSV} -> {HISTORY_PARQUET} ({df.shape[0]} rows)")
+
+    # Forecast table -> Feather, uncompressed so seed.py can memory-map it
+    df_forecast = pd.read_csv(FORECAST_CSV, engine='pyarrow', parse_dates=['forecast_date'])
+    feather.write_feather(df_forecast, FORECAST_FEATHER, compression='uncompressed')
+    print(f"   ✅ {FORECAST_CSV} -> {FORECAST_FEATHER} ({df_forecast.shape[0]} rows)")
+
+if __name__ == '__main__':
+    convert()
@@ -1,15 +1,33 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from prisma import Prisma
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
+from collections import OrderedDict
+import time
 import numpy as np
 import pandas as pd
 from prophet import Prophet
 from fastapi.middleware.cors import CORSMiddleware
 from blob_storage import get_storage_backend
 
+# Cyclical calendar features as lookup tables (index = month 1..12 / ISO week 1..53)
+# Same formula as training, so values are identical to computing per row.
+MONTH_SIN = np.sin(2 * np.pi * np.arange(13) / 12)
+MONTH_COS = np.cos(2 * np.pi * np.arange(13) / 12)
+WEEK_SIN = np.sin(2 * np.pi * np.arange(54) / 52)
+WEEK_COS = np.cos(2 * np.pi * np.arange(54) / 52)
+
+# Stored Prophet trends (ds/yhat) older than this are regenerated even if history is unchanged
+TREND_MAX_AGE_DAYS = 7
+
+# Fitted Prophet models per product, most recently used last.
+# Value is (history_fingerprint, model); a changed history forces a refit.
+PROPHET_CACHE_SIZE = 256
+PROPHET_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+
 class SalesRecord(BaseModel):
     product_code: str
     ds: datetime
@@ -60,7 +78,7 @@ async def lifespan(app: FastAPI):
             # B. Load Global LGBM (Contract Checked inside storage)
             app.state.models['lgb'] = storage.load_global_lgbm(manifest)
             
-            # C. Load Encoder Map (JSON Dict)
+            # C. Load Encoder Map (JSON/msgpack Dict)
             app.state.models['encoder_map'] = storage.load_encoder(manifest)
             
             print("   ✅ ML Engine Ready (Pickle-Free Mode)")
@@ -128,7 +146,8 @@ async def get_metrics():
 @app.post("/sales/forecast/live/{product_id}")
 async def generate_live_forecast(product_id: str, background_tasks: BackgroundTasks):
     """
-    Safe Live Inference using Native Text/JSON models.
+    Safe Live Inference: cached Prophet trend (msgpack) or live Prophet fit,
+    then the native-text global LGBM model.
     """
     db = app.state.db
     storage = app.state.storage
@@ -159,37 +178,57 @@ async def generate_live_forecast(product_id: str, background_tasks: BackgroundTa
     df_history = df_history.rename(columns={'ds': 'ds', 'y': 'y'})
     df_history['y_log'] = np.log1p(df_history['y'])
 
-    # 2. Load or Create Prophet (JSON Mode)
-    # Using 'storage.load_prophet_model' handles the JSON deserialization safely
-    m = storage.load_prophet_model(product_id)
-    
-    seasonality = True if len(df_history) > 52 else False
+    # 2. Prophet baseline: stored trend -> in-process model -> fresh fit
+    # (Prophet objects can only be fit once, so a stored model can't be refit)
+    history_key = [len(df_history), int(df_history['ds'].iloc[-1].value), float(df_history['y'].sum())]
+    trend = await asyncio.to_thread(storage.load_prophet_trend, product_id)  # disk/blob I/O off the event loop
+
+    if (trend and trend['history_key'] == history_key
+            and time.time() - trend['saved_at'] < TREND_MAX_AGE_DAYS * 86400):
+        # Only ds/yhat feed the LGBM features, so a fresh trend skips Prophet entirely
+        forecast = pd.DataFrame({
+            'ds': pd.to_datetime(np.asarray(trend['ds'], dtype=np.int64)),
+            'yhat': np.asarray(trend['yhat'], dtype=float)
+        })
+    else:
+        cached = PROPHET_CACHE.get(product_id)
 
-    if m:
-        try:
-            m.fit(df_history) # Refit existing
-        except Exception:
-            # If old model state is corrupt or incompatible, reset
+        if cached and cached[0] == history_key:
+            m = cached[1]
+            PROPHET_CACHE.move_to_end(product_id)
+        else:
+            seasonality = True if len(df_history) > 52 else False
             m = Prophet(yearly_seasonality=seasonality)
-            m.fit(df_history)
-    else:
-        m = Prophet(yearly_seasonality=seasonality)
-        m.fit(df_history)
+            await asyncio.to_thread(m.fit, df_history)  # CPU-bound Stan fit off the event loop
+            PROPHET_CACHE[product_id] = (history_key, m)
+            PROPHET_CACHE.move_to_end(product_id)
+            if len(PROPHET_CACHE) > PROPHET_CACHE_SIZE:
+                PROPHET_CACHE.popitem(last=False)
+
+        future = m.make_future_dataframe(periods=104, freq='W')
+        forecast = await asyncio.to_thread(m.predict, future)
+
+        # Background: persist the trend so later requests (any worker) can skip Prophet
+        background_tasks.add_task(storage.save_prophet_trend, product_id, {
+            'history_key': history_key,
+            'saved_at': time.time(),
+            'ds': forecast['ds'].astype(np.int64).tolist(),
+            'yhat': forecast['yhat'].tolist()
+        })
 
     # 3. Generate Features
-    future = m.make_future_dataframe(periods=104, freq='W')
-    forecast = m.predict(future)
-    
     df_features = forecast[['ds', 'yhat']].rename(columns={'yhat': 'prophet_pred_log'})
     
     # --- Feature Engineering (MUST MATCH MANIFEST) ---
     df_features['month'] = df_features['ds'].dt.month
     df_features['week'] = df_features['ds'].dt.isocalendar().week.astype(int)
     df_features['year'] = df_features['ds'].dt.year
-    df_features['month_sin'] = np.sin(2 * np.pi * df_features['month'] / 12)
-    df_features['month_cos'] = np.cos(2 * np.pi * df_features['month'] / 12)
-    df_features['week_sin'] = np.sin(2 * np.pi * df_features['week'] / 52)
-    df_features['week_cos'] = np.cos(2 * np.pi * df_features['week'] / 52)
+    months = df_features['month'].to_numpy()
+    weeks = df_features['week'].to_numpy()
+    df_features['month_sin'] = MONTH_SIN[months]
+    df_features['month_cos'] = MONTH_COS[months]
+    df_features['week_sin'] = WEEK_SIN[weeks]
+    df_features['week_cos'] = WEEK_COS[weeks]
 
     # Encoding: Safe Dict Lookup
     # If key doesn't exist, return -1 (Unknown Product)
@@ -205,36 +244,34 @@ async def generate_live_forecast(product_id: str, background_tasks: BackgroundTa
         if col not in df_features.columns:
             raise ValueError(f"Missing feature required by model: {col}")
 
-    lgb_preds_log = lgbm_model.predict(df_features[feature_order])
+    # Contiguous float64 matrix (skips LGBM's pandas conversion; float32 could flip split thresholds)
+    X = np.ascontiguousarray(df_features[feature_order].to_numpy(dtype=np.float64))
+    lgb_preds_log = await asyncio.to_thread(lgbm_model.predict, X)
     df_features['predicted_sales'] = np.expm1(lgb_preds_log).clip(min=0)
 
     # 5. Save & Return
     
-    # Background: Save updated Prophet model as JSON
-    background_tasks.add_task(storage.save_prophet_model, m, product_id)
-
     # Filter for future only
     last_history_date = df_history['ds'].max()
-    df_final = df_features[df_features['ds'] > last_history_date]
-
-    response_data = []
-    db_batch = []
-    
-    for _, row in df_final.iterrows():
-        response_data.append({
-            'date': row['ds'].strftime('%Y-%m-%d'),
-            'sales': round(float(row['predicted_sales']), 2)
-        })
-        db_batch.append({
-            'product_code': product_id,
-            'forecast_date': row['ds'],
-            'predicted_sales': float(row['predicted_sales'])
-        })
-
-    # DB Transaction
-    await db.salesforecast.delete_many(where={'product_code': product_id})
-    if db_batch:
-        await db.salesforecast.create_many(data=db_batch)
+    df_final = df_features.loc[df_features['ds'] > last_history_date, ['ds', 'predicted_sales']]
+    predicted_sales = df_final['predicted_sales'].astype(float)
+
+    # Column-wise conversion (no iterrows)
+    response_data = [
+        {'date': date, 'sales': round(sales, 2)}
+        for date, sales in zip(df_final['ds'].dt.strftime('%Y-%m-%d'), predicted_sales.tolist())
+    ]
+    db_batch = pd.DataFrame({
+        'product_code': product_id,
+        'forecast_date': df_final['ds'],
+        'predicted_sales': predicted_sales
+    }).to_dict(orient='records')
+
+    # DB Transaction: delete + insert sent as one batched, atomic request
+    async with db.batch_() as batcher:
+        batcher.salesforecast.delete_many(where={'product_code': product_id})
+        if db_batch:
+            batcher.salesforecast.create_many(data=db_batch)
 
     return {
         "status": "success", 
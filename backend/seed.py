@@ -1,9 +1,28 @@
 import asyncio
 import pandas as pd
+import pyarrow.feather as feather
 from prisma import Prisma
 import numpy as np
 import os
 
+CHUNK_SIZE = 1000
+
+def chunked(records, size=CHUNK_SIZE):
+    """Yield fixed-size slices so no single insert carries the whole table"""
+    for i in range(0, len(records), size):
+        yield records[i:i + size]
+
+def is_fresh_copy(copy_path, csv_path):
+    """True if the columnar copy exists and its source CSV is absent or not newer"""
+    if not os.path.exists(copy_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True # Columnar-only checkout
+    if os.path.getmtime(copy_path) < os.path.getmtime(csv_path):
+        print(f"   ⚠️ {copy_path} is older than {csv_path}; reading CSV (re-run convert_csv_to_parquet.py)")
+        return False
+    return True
+
 async def seed_data():
     db = Prisma()
     await db.connect()
@@ -13,26 +32,29 @@ async def seed_data():
     # --- 1. Seed History (from sales_data_final.csv) ---
     try:
         print("   -> Loading History...")
-        df = pd.read_csv('./ml_bin/sales_data_final.csv') # Path to your source data
+        # Prefer the columnar copy (see convert_csv_to_parquet.py) unless the CSV is newer
+        if is_fresh_copy('./ml_bin/sales_data_final.parquet', './ml_bin/sales_data_final.csv'):
+            df = pd.read_parquet('./ml_bin/sales_data_final.parquet')
+        else:
+            df = pd.read_csv('./ml_bin/sales_data_final.csv', engine='pyarrow') # Path to your source data
         
-        # Melt Logic
+        # Wide -> long via NumPy reshape (row-major: each product's weeks in order)
         id_vars = ['Product_Code']
         date_cols = [c for c in df.columns if c not in id_vars]
-        df_long = df.melt(id_vars=id_vars, value_vars=date_cols, var_name='ds', value_name='y')
-        df_long['ds'] = pd.to_datetime(df_long['ds'])
-
-        # Prepare batch for Prisma
-        history_records = []
-        for _, row in df_long.iterrows():
-            history_records.append({
-                'product_code': str(row['Product_Code']),
-                'ds': row['ds'],
-                'y': float(row['y'])
-            })
-
-        # Bulk Create (Chunking recommended for large datasets)
-        # Using create_many is much faster
-        await db.saleshistory.create_many(data=history_records, skip_duplicates=True)
+        values = df[date_cols].to_numpy(dtype=float)
+        n_products, n_weeks = values.shape
+        df_long = pd.DataFrame({
+            'product_code': np.repeat(df['Product_Code'].astype(str).to_numpy(), n_weeks),
+            'ds': np.tile(pd.to_datetime(date_cols).to_numpy(), n_products),
+            'y': values.ravel()
+        })
+
+        # Prepare batch for Prisma (column-wise, no iterrows)
+        history_records = df_long.to_dict(orient='records')
+
+        # Bulk Create in chunks (bounded packet size / Postgres bind-parameter limit)
+        for batch in chunked(history_records):
+            await db.saleshistory.create_many(data=batch, skip_duplicates=True)
         print(f"   ✅ Inserted {len(history_records)} history records.")
 
     except Exception as e:
@@ -42,21 +64,20 @@ async def seed_data():
     try:
         print("   -> Loading Forecasts...")
         # Load the CSV you generated in Phase 4 of training pipeline
-        df_forecast = pd.read_csv('./ml_bin/final_forecast_backup.csv') 
-        df_forecast['forecast_date'] = pd.to_datetime(df_forecast['forecast_date'])
+        if is_fresh_copy('./ml_bin/final_forecast_backup.feather', './ml_bin/final_forecast_backup.csv'):
+            df_forecast = feather.read_feather('./ml_bin/final_forecast_backup.feather', memory_map=True)
+        else:
+            df_forecast = pd.read_csv('./ml_bin/final_forecast_backup.csv', engine='pyarrow', parse_dates=['forecast_date'])
 
-        forecast_records = []
-        for _, row in df_forecast.iterrows():
-            forecast_records.append({
-                'product_code': str(row['product_code']),
-                'forecast_date': row['forecast_date'],
-                'predicted_sales': float(row['predicted_sales'])
-            })
+        df_forecast['product_code'] = df_forecast['product_code'].astype(str)
+        df_forecast['predicted_sales'] = df_forecast['predicted_sales'].astype(float)
+        forecast_records = df_forecast[['product_code', 'forecast_date', 'predicted_sales']].to_dict(orient='records')
 
         # Clear old forecasts first (Pipeline logic: replace)
         await db.salesforecast.delete_many()
         
-        await db.salesforecast.create_many(data=forecast_records, skip_duplicates=True)
+        for batch in chunked(forecast_records):
+            await db.salesforecast.create_many(data=batch, skip_duplicates=True)
         print(f"   ✅ Inserted {len(forecast_records)} forecast records.")
 
     except Exception as e: